@@ -1 +1,7 @@
-from .arable_api import gather_data, get_data, get_datasets, get_devices, get_response
\ No newline at end of file
+from .arable_api import (
+    gather_data,
+    get_data,
+    get_datasets,
+    get_devices,
+    get_response,
+)
@@ -2,34 +2,74 @@ from __future__ import annotations
 from .arable_api import gather_data
 import click
 import datetime as dt
-from pathlib import Path
+import os
 
 
 @click.command()
 @click.option(
-    "-f", "--folder", default="./", help="Folder where to save CSV files"
+    "-f", "--folder", default="./", help="Folder where to save output files"
 )
 @click.option("-d", "--date", default=None, help="Date to gather data")
-def main(folder, date):
+@click.option(
+    "-w",
+    "--max-workers",
+    default=8,
+    help="Number of threads used to query devices concurrently",
+)
+@click.option(
+    "-F",
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "parquet"]),
+    default="parquet",
+    help="Output file format",
+)
+@click.option(
+    "-r",
+    "--range-days",
+    default=1,
+    help="Days per API request; output stays one file per date",
+)
+def main(folder, date, max_workers, file_format, range_days):
     if date is not None:
         try:
             date = dt.datetime.strptime(date, "%Y-%m-%d")
         except ValueError:
             print("date option should be given as 'YYYY-MM-DD'")
-        gather_data(folder, start_time=date)
+        gather_data(
+            folder,
+            start_time=date,
+            max_workers=max_workers,
+            file_format=file_format,
+            range_days=range_days,
+        )
     else:
-        files = [f for f in Path(folder).glob("*.csv")]
-        if not files:  # No files, start downloading yesterday
-            gather_data(folder)
-        else:
-            dates = sorted(
-                [
-                    dt.datetime.strptime(f.name.split("_")[0], "%Y-%m-%d")
-                    for f in files
-                ]
+        # Filenames start with an ISO date, which sorts lexicographically
+        # in chronological order, so a string max() over the 10-char
+        # prefix finds the latest file without a strptime per entry.
+        with os.scandir(folder) as entries:
+            prefixes = [
+                e.name[:10]
+                for e in entries
+                if e.name.endswith((".csv", ".parquet"))
+            ]
+        if not prefixes:  # No files, start downloading yesterday
+            gather_data(
+                folder,
+                max_workers=max_workers,
+                file_format=file_format,
+                range_days=range_days,
             )
+        else:
+            latest = dt.datetime.strptime(max(prefixes), "%Y-%m-%d")
             # find the latest date available and start on the following day
-            gather_data(folder, start_time=dates[-1] + dt.timedelta(days=1))
+            gather_data(
+                folder,
+                start_time=latest + dt.timedelta(days=1),
+                max_workers=max_workers,
+                file_format=file_format,
+                range_days=range_days,
+            )
 
 
 main()
@@ -1,13 +1,24 @@
 from __future__ import annotations
 import concurrent.futures
+import csv
+import functools
 import logging
+import threading
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import datetime as dt
 import os
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
+try:
+    # orjson parses straight from bytes with a much faster C decoder
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
 # Remove the default handler from the root logger
 logging.getLogger().handlers = []
 
@@ -29,6 +40,52 @@ console_handler.setFormatter(formatter)
 # Add the handler to the logger
 logger.addHandler(console_handler)
 
+# Shared session so TCP+TLS connections are kept alive between calls.
+# Transient server errors and rate limiting are retried with backoff.
+# The pool is sized for gather_data's full fan-out (schemas x device
+# workers) so no connection gets dropped and re-handshaken under load.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=160,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=True,
+        ),
+    ),
+)
+
+# Large write buffer so CSV output hits the disk in multi-MiB chunks
+# rather than one syscall per row.
+_CSV_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Responses are streamed in bounded chunks into one reusable buffer per
+# worker thread; buffers that grow past the cap are released afterwards
+# so an occasional huge payload doesn't stay pinned in every thread.
+_READ_CHUNK_SIZE = 128 * 1024
+_MAX_POOLED_BUFFER = 1024 * 1024
+_THREAD_LOCAL = threading.local()
+
+
+def _read_body(r: requests.Response) -> bytearray:
+    """Reads a streamed response into the calling thread's reusable
+    buffer and returns it. The buffer is only valid until the next
+    `_read_body` call on the same thread."""
+    buf = getattr(_THREAD_LOCAL, "buf", None)
+    if buf is None:
+        buf = _THREAD_LOCAL.buf = bytearray()
+    else:
+        del buf[:]
+    for chunk in r.iter_content(chunk_size=_READ_CHUNK_SIZE):
+        buf += chunk
+    return buf
+
+
 ALL_FIELDS = [
     "aux_raw",
     "calibrated",
@@ -84,10 +141,11 @@ def get_response(
             )
 
     url = f"{BASE_URL}/{service}"
-    r = requests.get(
+    r = _SESSION.get(
         url,
         headers={"Authorization": f"apikey {api_key}"},
         params=parameters,
+        stream=True,
     )
     if r.status_code != 200:
         msg = (
@@ -95,44 +153,44 @@ def get_response(
             + f"URL: {url}\n"
         )
         logger.error(msg)
-        raise requests.HTTPError("Problem accessing API endpoint\n" + msg)
-    return json.loads(r.content)
+        raise requests.HTTPError(
+            "Problem accessing API endpoint\n" + msg, response=r
+        )
+    body = _read_body(r)
+    retval = _json_loads(body)
+    if len(body) > _MAX_POOLED_BUFFER:
+        _THREAD_LOCAL.buf = bytearray()
+    return retval
 
 
 def get_datasets() -> dict:
     """Queries API for available measurements"""
     meas = get_response("schemas/calibrated")
-    ddatasets = pd.DataFrame(meas)
-    return dict(zip(ddatasets.column_name, ddatasets.description))
+    return {m["column_name"]: m["description"] for m in meas}
 
 
+@functools.lru_cache(maxsize=1)
 def get_devices() -> list:
+    # Cached: the device list is queried by every schema in gather_data
+    # but only needs one API round-trip per run.
     return [dev["name"] for dev in get_response("devices")["items"]]
 
 
-def get_data(
+def iter_data(
     schema: str = "data/local_hourly",
     devices: None | list | str = None,
     start_time: None | str | dt.datetime = None,
     end_time: None | str | dt.datetime = None,
-) -> pd.DataFrame | None:
-    """Get data from the Arable API
+    max_workers: int = 8,
+):
+    """Yields the raw JSON records for each device in `devices`, one
+    list of record dicts per device, as they are downloaded. Arguments
+    are the same as for `get_data`; devices that fail or return no
+    records are skipped. Only one device's response needs to be held
+    in memory at a time by the consumer.
 
-    Args:
-        schema (str, optional): Select a schema. Defaults to
-                "data/local_hourly".
-        devices (None | list | str, optional): Device or devices to gather
-                data from.
-             Defaults to `None`. If `None`, it will query all the devices and
-             download data from all of them
-        start_time (None | str | dt.datetime, optional): Start time. Defaults
-            to None. If `None`, it will assume today.
-        end_time (None | str | dt.datetime, optional): End time. Defaults to
-            `None`. Same comment as `start_time`.
-
-    Returns:
-        pd.DataFrame | None: A pandas DataFrame with the data for all the
-            requrested devices, or `None` if there's no data available.
+    Yields:
+        list[dict]: The decoded records for one device.
     """
     if not start_time:
         start_time = dt.datetime.now()
@@ -151,41 +209,164 @@ def get_data(
         devices = [
             devices,
         ]
-    retvals = []
-    for device in devices:
-        query = {
-            "device": device,
-            "limit": "5012",
-            "start_time": start_time.strftime("%Y-%m-%dT00:00:00Z"),
-            "end_time": end_time.strftime("%Y-%m-%dT23:59:59Z"),
-        }
+    # The time window is the same for every device, so format it once
+    # rather than calling strftime per device. One day fits the
+    # original 5012-row cap, so scale it with the window length to keep
+    # multi-day requests from being truncated.
+    n_days = max((end_time - start_time).days + 1, 1)
+    limit = 5012 * n_days
+    base_query = {
+        "limit": str(limit),
+        "start_time": start_time.strftime("%Y-%m-%dT00:00:00Z"),
+        "end_time": end_time.strftime("%Y-%m-%dT23:59:59Z"),
+    }
+
+    def fetch_device(device: str) -> list[dict] | None:
+        query = {**base_query, "device": device}
         try:
             retval = get_response(f"{schema}", parameters=query)
-        except requests.HTTPError:
-            continue
-        df = pd.DataFrame(retval)
-        if len(df) == 0:
+        except requests.HTTPError as err:
+            # Transient errors were already retried with backoff by the
+            # session adapter, so anything surfacing here is either a
+            # permanent client error (skip just this device) or worth
+            # failing loudly rather than silently losing data.
+            status = (
+                err.response.status_code if err.response is not None else None
+            )
+            if status is not None and 400 <= status < 500:
+                logger.warning(
+                    f"Skipping {device} for {schema} "
+                    f"(HTTP {status}): {err}"
+                )
+                return None
+            raise
+        if len(retval) == 0:
             logger.warning(f"{schema} returns 0 records")
-            continue
+            return None
+        if len(retval) >= limit:
+            logger.warning(
+                f"{schema}/{device}: response hit the {limit}-row "
+                "limit, data may be truncated"
+            )
+        return retval
+
+    # Each device query is a blocking HTTP round-trip, so fan out over
+    # the pooled session. `executor.map` keeps results in device order.
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers
+    ) as executor:
+        for records in executor.map(fetch_device, devices):
+            if records is not None:
+                yield records
 
-        df["timex"] = pd.to_datetime(df.time)
-        retvals.append(df.set_index("timex"))
-    return pd.concat(retvals, axis=0) if retvals else None
+
+def get_data(
+    schema: str = "data/local_hourly",
+    devices: None | list | str = None,
+    start_time: None | str | dt.datetime = None,
+    end_time: None | str | dt.datetime = None,
+    max_workers: int = 8,
+) -> pd.DataFrame | None:
+    """Get data from the Arable API
+
+    Args:
+        schema (str, optional): Select a schema. Defaults to
+                "data/local_hourly".
+        devices (None | list | str, optional): Device or devices to gather
+                data from.
+             Defaults to `None`. If `None`, it will query all the devices and
+             download data from all of them
+        start_time (None | str | dt.datetime, optional): Start time. Defaults
+            to None. If `None`, it will assume today.
+        end_time (None | str | dt.datetime, optional): End time. Defaults to
+            `None`. Same comment as `start_time`.
+        max_workers (int, optional): Number of threads used to query
+            devices concurrently. Defaults to 8.
+
+    Returns:
+        pd.DataFrame | None: A pandas DataFrame with the data for all the
+            requrested devices, sorted by device and time (the parsed
+            timestamps live in the `timex` column), or `None` if there's
+            no data available.
+    """
+    chunks = list(
+        iter_data(
+            schema=schema,
+            devices=devices,
+            start_time=start_time,
+            end_time=end_time,
+            max_workers=max_workers,
+        )
+    )
+    if not chunks:
+        return None
+    # Build the union of columns once and fill a single preallocated
+    # array. pd.concat aligns the (often heterogeneous) columns of every
+    # per-device frame, which gets pathologically slow for the wide,
+    # sparse schemas; one pass over the raw records avoids that.
+    columns: list[str] = []
+    seen: set[str] = set()
+    for records in chunks:
+        for rec in records:
+            for key in rec:
+                if key not in seen:
+                    seen.add(key)
+                    columns.append(key)
+    col_idx = {col: i for i, col in enumerate(columns)}
+    n_rows = sum(len(records) for records in chunks)
+    values = np.full((n_rows, len(columns)), np.nan, dtype=object)
+    row = 0
+    for records in chunks:
+        for rec in records:
+            for key, val in rec.items():
+                values[row, col_idx[key]] = val
+            row += 1
+    # The API returns fixed ISO-8601 timestamps; spelling the format
+    # out keeps pandas on its C fast path instead of per-element
+    # dateutil guessing.
+    timex = pd.to_datetime(
+        [rec.get("time") for records in chunks for rec in records],
+        format="%Y-%m-%dT%H:%M:%SZ",
+        utc=True,
+        cache=True,
+    )
+    # Keep timestamps as a plain column: indexing on timex only forced
+    # an index union/sort downstream, and to_csv/to_parquet emit the
+    # column just the same. One stable sort at the end is enough, since
+    # rows are already grouped by device.
+    # infer_objects() recovers proper float64/int64 dtypes from the
+    # object-dtype staging array in one pass.
+    df = pd.DataFrame(values, columns=columns).infer_objects()
+    df["timex"] = timex
+    sort_cols = ["device", "timex"] if "device" in col_idx else ["timex"]
+    return df.sort_values(sort_cols, kind="stable", ignore_index=True)
 
 
 def gather_data(
     output_folder: str | Path,
     start_time: None | dt.datetime | str = None,
+    max_workers: int = 8,
+    file_format: str = "parquet",
+    range_days: int = 1,
 ) -> list[Path]:
-    """Gathers data and dumps it to a set of CSV files
+    """Gathers data and dumps it to a set of Parquet or CSV files
     in `output_folder`.
 
     Args:
-        output_folder (str | Path): Location where CSV files will be
+        output_folder (str | Path): Location where output files will be
             saved.
         start_time (None | dt.datetime | str, optional): Date on which
         to download data. Defaults to None, which means download all
         the data collected yesterday.
+        max_workers (int, optional): Number of threads used for the
+            per-device queries within each schema. Defaults to 8.
+        file_format (str, optional): Either "parquet" (zstd-compressed,
+            much faster to write and read and far smaller on disk) or
+            "csv". Defaults to "parquet".
+        range_days (int, optional): Number of consecutive days starting
+            at `start_time` to request in a single API call per device.
+            The download is still split into one file per date on disk.
+            Defaults to 1.
 
     Returns:
         list[Path]: List of filenames saved.
@@ -204,32 +385,199 @@ def gather_data(
         logger.info(f"Given date {start_time.strftime('%Y-%m-%d')}")
     output_folder = Path(output_folder)
     output_folder.mkdir(parents=True, exist_ok=True)
-    # Download & save to CSV using different threads
+    # One /devices round-trip shared by every schema worker
+    devices = get_devices()
+    # Download & save each schema using different threads
     with concurrent.futures.ThreadPoolExecutor() as executor:
         futures = []
         for schema in ALL_FIELDS:
             future = executor.submit(
-                downloader, output_folder, start_time, schema
+                downloader,
+                output_folder,
+                start_time,
+                schema,
+                max_workers,
+                devices,
+                file_format,
+                range_days,
             )
             futures.append(future)
 
         # Wait for all threads to complete
+        files = []
         for future in concurrent.futures.as_completed(futures):
-            files = future.result()
+            files.extend(future.result())
     return files
 
 
 def downloader(
-    output_folder: Path, start_time: dt.datetime, schema: str
-) -> Path | None:
-    df = get_data(schema=f"data/{schema}", start_time=start_time)
-    if df is not None:
+    output_folder: Path,
+    start_time: dt.datetime,
+    schema: str,
+    max_workers: int = 8,
+    devices: None | list = None,
+    file_format: str = "parquet",
+    range_days: int = 1,
+) -> list[Path]:
+    # Requesting several days in one call amortizes the per-request
+    # overhead; the result is split back into one file per date so the
+    # on-disk layout is independent of range_days.
+    end_time = start_time + dt.timedelta(days=range_days - 1)
+    if file_format == "parquet":
+        # Columnar output: serialize the typed columns directly rather
+        # than formatting every value to text.
+        df = get_data(
+            schema=f"data/{schema}",
+            devices=devices,
+            start_time=start_time,
+            end_time=end_time,
+            max_workers=max_workers,
+        )
+        if df is None:
+            logger.info(f"{schema} may not be available?")
+            return []
+        locs = []
+        for day, day_df in df.groupby(df["timex"].dt.date):
+            loc = output_folder / f"{day}_{schema}.parquet"
+            day_df.to_parquet(
+                loc,
+                engine="pyarrow",
+                compression="zstd",
+                compression_level=3,
+            )
+            logger.info(f"Saved {schema} -> {loc}")
+            locs.append(loc)
+        return locs
+    batches = iter_data(
+        schema=f"data/{schema}",
+        devices=devices,
+        start_time=start_time,
+        end_time=end_time,
+        max_workers=max_workers,
+    )
+    if range_days == 1:
         loc = (
             output_folder / f"{start_time.strftime('%Y-%m-%d')}_{schema}.csv"
         )
-        df.to_csv(loc)
-        logger.info(f"Saved {schema} -> {loc}")
-        return loc
+        locs = [loc] if _write_records_to_csv(batches, loc) else []
     else:
+        locs = _write_records_to_csv_by_date(
+            batches, output_folder, schema, start_time.strftime("%Y-%m-%d")
+        )
+    if not locs:
         logger.info(f"{schema} may not be available?")
-    return None
+        return []
+    for loc in locs:
+        logger.info(f"Saved {schema} -> {loc}")
+    return locs
+
+
+class _CsvBatchWriter:
+    """Streams batches of record dicts into the CSV file `loc`, keeping
+    the header in sync with the union of keys seen so far. The file is
+    created lazily on the first batch; if a later batch introduces new
+    columns, the rows already on disk are rewritten once with the
+    extended header, so no column is ever silently dropped. Devices
+    rarely disagree on columns, so the rewrite is the cold path."""
+
+    def __init__(self, loc: Path):
+        self.loc = loc
+        self._fh = None
+        self._writer = None
+        self._fieldnames: list[str] = []
+        self._seen: set[str] = set()
+
+    def write_batch(self, records: list[dict]) -> None:
+        new_keys = []
+        for rec in records:
+            for key in rec:
+                if key not in self._seen:
+                    self._seen.add(key)
+                    new_keys.append(key)
+        if new_keys:
+            self._fieldnames.extend(new_keys)
+            if self._writer is not None:
+                logger.info(
+                    f"{self.loc.name}: extending header with "
+                    f"new columns {new_keys}"
+                )
+                self._extend_header()
+        if self._writer is None:
+            self._fh = open(
+                self.loc, "w", buffering=_CSV_BUFFER_SIZE, newline=""
+            )
+            self._writer = csv.DictWriter(
+                self._fh, fieldnames=self._fieldnames, restval=""
+            )
+            self._writer.writeheader()
+        self._writer.writerows(records)
+
+    def _extend_header(self) -> None:
+        """Rewrites the rows already on disk under the extended header
+        and reopens the file in append mode."""
+        self._fh.close()
+        tmp = self.loc.with_name(self.loc.name + ".tmp")
+        with open(self.loc, newline="") as src, open(
+            tmp, "w", buffering=_CSV_BUFFER_SIZE, newline=""
+        ) as dst:
+            reader = csv.DictReader(src)
+            writer = csv.DictWriter(
+                dst, fieldnames=self._fieldnames, restval=""
+            )
+            writer.writeheader()
+            writer.writerows(reader)
+        tmp.replace(self.loc)
+        self._fh = open(self.loc, "a", buffering=_CSV_BUFFER_SIZE, newline="")
+        self._writer = csv.DictWriter(
+            self._fh, fieldnames=self._fieldnames, restval=""
+        )
+
+    @property
+    def wrote_anything(self) -> bool:
+        return self._writer is not None
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+
+
+def _write_records_to_csv(batches, loc: Path) -> bool:
+    """Streams batches of record dicts into the CSV file `loc`, so the
+    decoded JSON never goes through a DataFrame. The file is created
+    lazily on the first non-empty batch and its header tracks the union
+    of keys across all batches. Returns `True` if anything was
+    written."""
+    writer = _CsvBatchWriter(loc)
+    try:
+        for records in batches:
+            writer.write_batch(records)
+    finally:
+        writer.close()
+    return writer.wrote_anything
+
+
+def _write_records_to_csv_by_date(
+    batches, output_folder: Path, schema: str, default_day: str
+) -> list[Path]:
+    """Streams batches of record dicts into one CSV file per date, keyed
+    on the ISO date prefix of each record's `time` field (falling back
+    to `default_day`). Files and headers are created lazily as dates
+    show up; each file's header tracks the union of keys it has seen.
+    Returns the list of files written."""
+    writers: dict[str, _CsvBatchWriter] = {}
+    try:
+        for records in batches:
+            by_day: dict[str, list[dict]] = {}
+            for rec in records:
+                day = str(rec.get("time", default_day))[:10]
+                by_day.setdefault(day, []).append(rec)
+            for day, rows in by_day.items():
+                if day not in writers:
+                    writers[day] = _CsvBatchWriter(
+                        output_folder / f"{day}_{schema}.csv"
+                    )
+                writers[day].write_batch(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return [writer.loc for writer in writers.values()]
@@ -4,7 +4,11 @@ import requests
 from unittest.mock import patch
 import pytest
 
-from src.arable_api import get_response
+from src.arable_api import get_data, get_response
+from src.arable_api.arable_api import (
+    _write_records_to_csv,
+    _write_records_to_csv_by_date,
+)
 
 # Test cases
 
@@ -36,10 +40,12 @@ def test_get_response_success():
     parameters = {"param1": "value1", "param2": "value2"}
     expected_result = {"key": "value"}
 
-    # Mock the requests library to return a successful response
-    with patch("requests.get") as mock_get:
+    # Mock the shared session to return a successful response
+    with patch("src.arable_api.arable_api._SESSION.get") as mock_get:
         mock_get.return_value.status_code = 200
-        mock_get.return_value.content = '{"key": "value"}'
+        mock_get.return_value.iter_content.return_value = [
+            b'{"key": "value"}'
+        ]
 
         result = get_response(service, parameters)
 
@@ -47,6 +53,7 @@ def test_get_response_success():
             f"https://api.arable.cloud/api/v2/{service}",
             headers={"Authorization": "apikey ARABLE_API_KEY"},
             params=parameters,
+            stream=True,
         )
         assert result == expected_result
 
@@ -56,8 +63,8 @@ def test_get_response_http_error():
     service = "example_service"
     parameters = {"param1": "value1"}
 
-    # Mock the requests library to return a non-200 status code
-    with patch("requests.get") as mock_get:
+    # Mock the shared session to return a non-200 status code
+    with patch("src.arable_api.arable_api._SESSION.get") as mock_get:
         mock_get.return_value.status_code = 404
         mock_get.return_value.content = "Not found"
 
@@ -68,9 +75,96 @@ def test_get_response_http_error():
             f"https://api.arable.cloud/api/v2/{service}",
             headers={"Authorization": "apikey ARABLE_API_KEY"},
             params=parameters,
+            stream=True,
         )
 
 
+def test_write_records_to_csv_column_union(tmp_path):
+    # Columns that only later batches report must still end up in the
+    # file, with earlier rows padded with empty values
+    loc = tmp_path / "out.csv"
+    batches = [
+        [{"time": "t1", "temp": 1}],
+        [{"time": "t2", "temp": 2, "humidity": 55}],
+    ]
+
+    assert _write_records_to_csv(iter(batches), loc)
+    lines = loc.read_text().splitlines()
+    assert lines[0] == "time,temp,humidity"
+    assert lines[1] == "t1,1,"
+    assert lines[2] == "t2,2,55"
+
+
+def test_write_records_to_csv_empty(tmp_path):
+    # No records -> no file created
+    loc = tmp_path / "out.csv"
+
+    assert not _write_records_to_csv(iter([]), loc)
+    assert not loc.exists()
+
+
+def test_write_records_to_csv_by_date(tmp_path):
+    # Records are split into one file per ISO date prefix, and each
+    # file's header is the union of the keys it has seen
+    batches = [
+        [
+            {"time": "2024-01-01T00:00:00Z", "a": 1},
+            {"time": "2024-01-02T00:00:00Z", "a": 2, "b": 5},
+        ],
+        [{"time": "2024-01-01T01:00:00Z", "humidity": 55}],
+    ]
+
+    locs = _write_records_to_csv_by_date(
+        iter(batches), tmp_path, "hourly", "2024-01-01"
+    )
+
+    assert sorted(loc.name for loc in locs) == [
+        "2024-01-01_hourly.csv",
+        "2024-01-02_hourly.csv",
+    ]
+    day1 = (tmp_path / "2024-01-01_hourly.csv").read_text().splitlines()
+    assert day1[0] == "time,a,humidity"
+    assert day1[1] == "2024-01-01T00:00:00Z,1,"
+    assert day1[2] == "2024-01-01T01:00:00Z,,55"
+    day2 = (tmp_path / "2024-01-02_hourly.csv").read_text().splitlines()
+    assert day2 == ["time,a,b", "2024-01-02T00:00:00Z,2,5"]
+
+
+def test_get_data_builds_union_frame():
+    # get_data must return the union of the devices' columns, with
+    # numeric dtypes inferred and rows sorted by (device, timex)
+    responses = {
+        "d1": [
+            {"time": "2024-01-01T01:00:00Z", "temp": 2.0, "device": "d1"},
+            {"time": "2024-01-01T00:00:00Z", "temp": 1.0, "device": "d1"},
+        ],
+        "d2": [
+            {"time": "2024-01-01T00:00:00Z", "humidity": 55, "device": "d2"}
+        ],
+    }
+
+    with patch(
+        "src.arable_api.arable_api.get_response",
+        side_effect=lambda s, parameters=None: responses[
+            parameters["device"]
+        ],
+    ):
+        df = get_data(devices=["d1", "d2"], start_time="2024-01-01")
+
+    assert set(df.columns) == {"time", "temp", "humidity", "device", "timex"}
+    assert df["temp"].dtype == "float64"
+    assert list(df["device"]) == ["d1", "d1", "d2"]
+    # Within a device, rows come out sorted by timestamp
+    assert df["timex"].iloc[0] < df["timex"].iloc[1]
+    assert df["temp"].isna().tolist() == [False, False, True]
+
+
+def test_get_data_no_records():
+    # Devices with empty responses are skipped; no data means None
+    with patch("src.arable_api.arable_api.get_response", return_value=[]):
+        assert get_data(devices=["d1"], start_time="2024-01-01") is None
+
+
 # Environment setup
 
 